@@ -0,0 +1,484 @@
+#########################################################################
+#
+# Copyright (C) 2022 Leibniz-Centre for Agricultural Landscape
+# Research (ZALF) e.V.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""shared loading pipeline for the thesaurus importer commands
+
+Copy this module (together with _thesaurus_utils.py) next to the
+load_*_thesaurus.py commands into geonode/base/management/commands/.
+The leading underscore keeps Django from listing it as a command.
+"""
+
+import io
+import mmap
+import os
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from sys import intern
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rdflib.util import guess_format
+
+from geonode.base.models import Thesaurus, ThesaurusKeyword, ThesaurusKeywordLabel
+
+from ._thesaurus_utils import lower_if_needed, value_for_language
+
+# pyoxigraph (Rust-backed) streams triples without building an in-memory
+# Python triple store; rdflib remains as fallback when it is not installed
+try:
+    import pyoxigraph
+except ImportError:
+    pyoxigraph = None
+
+# To reduce storage the loaders only include languages supported by geonode,
+# not all languages included in the thesauri
+SUPPORTED_LANGUAGES = frozenset(("fr", "de", "en", "it", "es"))
+DEFAULT_LANG = getattr(settings, "THESAURUS_DEFAULT_LANG", "en")
+
+# number of concepts buffered before flushing keywords/labels to the DB
+BULK_CREATE_BATCH_SIZE = 1000
+
+# number of concepts handed to a worker process at a time; loads smaller
+# than one chunk are encoded serially to skip the pool start-up cost
+CONCEPT_CHUNK_SIZE = 5000
+
+# rdflib format name (as returned by guess_format) -> MIME type for pyoxigraph
+RDF_MIME_TYPES = {
+    "xml": "application/rdf+xml",
+    "turtle": "text/turtle",
+    "nt": "application/n-triples",
+    "n3": "text/n3",
+    "trig": "application/trig",
+}
+
+# plain-data projection of the thesaurus file, shared by both parse paths of
+# each command: scheme/concepts are IRI strings, date is the raw date string
+# from the file, titles rdflib Literals, labels_by_concept maps concept IRI
+# -> [(lang, label), ...]
+ParsedThesaurus = namedtuple(
+    "ParsedThesaurus",
+    ["scheme", "date", "titles", "description", "concepts", "labels_by_concept"],
+)
+
+
+def parse_triples(input_file, mime_type: str):
+    """stream (subject, predicate, object) terms from the file via pyoxigraph
+
+    Bridges the API change in pyoxigraph 0.4: newer releases select the
+    format through an RdfFormat object and yield Quad objects, older ones
+    take a mime_type keyword and yield plain triples.
+    """
+
+    if hasattr(pyoxigraph, "RdfFormat"):
+        rdf_format = pyoxigraph.RdfFormat.from_media_type(mime_type)
+        for quad in pyoxigraph.parse(input_file, rdf_format):
+            yield quad.subject, quad.predicate, quad.object
+    else:
+        yield from pyoxigraph.parse(input_file, mime_type=mime_type)
+
+
+def encode_concept_chunk(chunk, defaultlang: str, lower_case: bool):
+    """turn [(concept IRI, [(lang, label)])] into (about, alt_label, label_rows) rows
+
+    Concepts without a pref label in the default language are skipped.
+    Operates on plain strings only, so chunks can be shipped to worker
+    processes without pickling rdflib or ORM objects.
+    """
+
+    # resolve the lower-case branch once instead of re-evaluating it for
+    # every keyword and label in the hot loop
+    normalize = lower_if_needed if lower_case else str
+
+    rows = []
+    for concept, concept_labels in chunk:
+        alt_label = next(
+            (label for lang, label in concept_labels if lang == defaultlang), None
+        )
+        if alt_label is None:
+            continue
+
+        label_rows = []
+        for lang, label in concept_labels:
+            # language tags are case-insensitive (BCP 47) and arrive
+            # lower-cased from the parsers; no point copying them
+            if lang not in SUPPORTED_LANGUAGES:
+                continue
+            label_rows.append((intern(lang), normalize(label)))
+        rows.append((normalize(concept), normalize(alt_label), label_rows))
+    return rows
+
+
+class ThesaurusLoader(BaseCommand):
+    """base command for loading a SKOS thesaurus into the GeoNode DB
+
+    Subclasses implement stream_parse/graph_parse to project their RDF
+    vocabulary into a ParsedThesaurus and may override thesaurus_date and
+    store_concepts where their behaviour differs.
+    """
+
+    def add_arguments(self, parser):
+        # Named (optional) arguments
+        parser.add_argument(
+            "-d",
+            "--dry-run",
+            action="store_true",
+            dest="dryrun",
+            default=False,
+            help="Only parse and print the thesaurus file, without perform insertion in the DB.",
+        )
+
+        parser.add_argument(
+            "--name",
+            dest="name",
+            help="Identifier name for the thesaurus in this GeoNode instance.",
+        )
+
+        parser.add_argument(
+            "--file", dest="file", help="Full path to a thesaurus in RDF format."
+        )
+
+        parser.add_argument(
+            "--force-lower-case",
+            dest="lower_case",
+            action="store_true",
+            help="all tkeywords and and tkeywordlabels are stored in lower case ...",
+        )
+
+        parser.add_argument(
+            "--defaultlang",
+            dest="default_lang",
+            type=str,
+            default=DEFAULT_LANG,
+            help="change default language.",
+        )
+
+        parser.add_argument(
+            "--verbose",
+            dest="verbose",
+            action="store_true",
+            help="print every keyword and label while loading; otherwise only a progress line per 1000 concepts is emitted.",
+        )
+
+    def handle(self, **options):
+        input_file = options.get("file")
+        name = options.get("name")
+        dryrun = options.get("dryrun")
+        defaultlang = options.get("default_lang")
+        lower_case = options.get("lower_case")
+        verbose = options.get("verbose")
+
+        if not input_file:
+            raise CommandError("Missing thesaurus rdf file path (--file)")
+
+        if not name:
+            raise CommandError("Missing identifier name for the thesaurus (--name)")
+
+        if dryrun:
+            self.load_thesaurus(
+                input_file=input_file,
+                name=name,
+                store=False,
+                defaultlang=defaultlang,
+                lower_case=lower_case,
+                verbose=verbose,
+            )
+        else:
+            # one transaction for the whole import: commit cost is amortized
+            # over all batches and a failure rolls back the half-loaded
+            # thesaurus instead of leaving it behind
+            with transaction.atomic():
+                self.load_thesaurus(
+                    input_file=input_file,
+                    name=name,
+                    store=True,
+                    defaultlang=defaultlang,
+                    lower_case=lower_case,
+                    verbose=verbose,
+                )
+
+    def load_thesaurus(
+        self,
+        input_file: str,
+        name: str,
+        store: bool,
+        defaultlang: str,
+        lower_case: bool,
+        verbose: bool = False,
+    ):
+        self.stderr.write(self.style.SUCCESS(f" using defaultlang: {defaultlang} ..."))
+        # if the input_file is an UploadedFile object rather than a file path the parser
+        # may not have enough info to correctly guess the type; in this case supply the
+        # name, which should include the extension, to guess_format manually...
+        if isinstance(input_file, UploadedFile):
+            self.stderr.write(
+                self.style.WARNING(f"Guessing RDF format from {input_file.name}...")
+            )
+            rdf_format = guess_format(input_file.name)
+        else:
+            rdf_format = guess_format(str(input_file))
+
+        self.stderr.write(
+            self.style.SUCCESS(f"Starting to parsed file: {input_file} ...")
+        )
+        mime_type = RDF_MIME_TYPES.get(rdf_format)
+
+        # memory-map plain file paths so the parsers read straight from the
+        # page cache instead of going through buffered read() calls; other
+        # inputs (UploadedFile, unknown formats that need the file name to
+        # guess from) are passed through untouched
+        parse_source = input_file
+        mm = None
+        fh = None
+        if isinstance(input_file, (str, os.PathLike)) and rdf_format is not None:
+            try:
+                fh = open(input_file, "rb")
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                parse_source = mm
+            except (OSError, ValueError):
+                # unmappable (e.g. empty) file; fall back to the path
+                if fh is not None:
+                    fh.close()
+                    fh = None
+
+        try:
+            if pyoxigraph is not None and mime_type is not None:
+                parsed = self.stream_parse(parse_source, mime_type)
+            else:
+                parsed = self.graph_parse(parse_source, rdf_format)
+        finally:
+            if mm is not None:
+                mm.close()
+            if fh is not None:
+                fh.close()
+        self.stderr.write(
+            self.style.SUCCESS(f"Successful parsed file: {input_file} ...")
+        )
+
+        thesaurus_title = value_for_language(parsed.titles, defaultlang)
+        description = parsed.description or thesaurus_title
+        thesaurus_date = self.thesaurus_date(parsed)
+
+        thesaurus = Thesaurus(
+            identifier=name,
+            description=description,
+            title=thesaurus_title,
+            about=parsed.scheme,
+            date=thesaurus_date,
+        )
+
+        if store:
+            thesaurus.save()
+
+        self.stderr.write(
+            self.style.SUCCESS(
+                f'Thesaurus "{thesaurus_title}", desc: {description} issued at {thesaurus_date}'
+            )
+        )
+
+        self._tk_buffer = []
+        self.store_concepts(parsed, thesaurus, store, defaultlang, lower_case, verbose)
+
+    def stream_parse(self, input_file, mime_type: str) -> ParsedThesaurus:
+        """single streaming pass over the RDF file using pyoxigraph"""
+        raise NotImplementedError
+
+    def graph_parse(self, input_file, rdf_format: str) -> ParsedThesaurus:
+        """parse via rdflib and project the graph into the same structures"""
+        raise NotImplementedError
+
+    def thesaurus_date(self, parsed: ParsedThesaurus) -> str:
+        """the date to store on the Thesaurus row, from the raw parsed date"""
+        return parsed.date
+
+    def store_concepts(
+        self, parsed, thesaurus, store, defaultlang, lower_case, verbose
+    ):
+        tk_buffer = self._tk_buffer
+        processed = 0
+
+        def store_encoded(encoded):
+            nonlocal processed
+            for about, alt_label, label_rows in encoded:
+                tk = ThesaurusKeyword(
+                    thesaurus=thesaurus, about=about, alt_label=alt_label
+                )
+                tk_buffer.append((tk, label_rows))
+                if len(tk_buffer) >= BULK_CREATE_BATCH_SIZE:
+                    self.flush_buffer(thesaurus, store)
+
+                # per-label output costs more than the DB writes on large
+                # dumps; emit a progress line per batch of concepts unless
+                # --verbose
+                processed += 1
+                if verbose:
+                    self.stderr.write(
+                        self.style.SUCCESS(
+                            f" set alt_label: {alt_label}: ({len(label_rows)})"
+                        )
+                    )
+                elif processed % 1000 == 0:
+                    self.stderr.write(f"processed {processed} concepts ...")
+
+        def iter_chunks():
+            concepts = parsed.concepts
+            labels_by_concept = parsed.labels_by_concept
+            for start in range(0, len(concepts), CONCEPT_CHUNK_SIZE):
+                yield [
+                    (concept, labels_by_concept.get(concept, ()))
+                    for concept in concepts[start : start + CONCEPT_CHUNK_SIZE]
+                ]
+
+        # the per-concept encoding only touches plain strings, so it can be
+        # sharded across worker processes; all DB writes stay in the parent
+        if len(parsed.concepts) > CONCEPT_CHUNK_SIZE:
+            encode = partial(
+                encode_concept_chunk, defaultlang=defaultlang, lower_case=lower_case
+            )
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                for encoded in executor.map(encode, iter_chunks()):
+                    store_encoded(encoded)
+        else:
+            for chunk in iter_chunks():
+                store_encoded(encode_concept_chunk(chunk, defaultlang, lower_case))
+
+        self.flush_buffer(thesaurus, store)
+        self.stderr.write(self.style.SUCCESS(f"processed {processed} concepts"))
+
+    def flush_buffer(self, thesaurus, store):
+        """bulk-save the buffered keywords and their labels, then clear the buffer
+
+        Dry runs skip the DB writes but still clear, so the buffer never
+        grows past one batch either way.
+        """
+
+        tk_buffer = self._tk_buffer
+        if not tk_buffer:
+            return
+        if store:
+            with transaction.atomic():
+                if supports_copy_from():
+                    self._flush_with_copy(thesaurus, tk_buffer)
+                else:
+                    self._flush_with_bulk_create(thesaurus, tk_buffer)
+        tk_buffer.clear()
+
+    def _keyword_ids(self, thesaurus, tk_buffer):
+        # query the generated pks back and reference them directly via
+        # keyword_id, instead of relying on bulk_create populating pks
+        # and Django dereferencing a keyword object per label
+        return dict(
+            ThesaurusKeyword.objects.filter(
+                thesaurus=thesaurus,
+                about__in=[tk.about for tk, _ in tk_buffer],
+            ).values_list("about", "id")
+        )
+
+    def _flush_with_copy(self, thesaurus, tk_buffer):
+        """stream the batch through PostgreSQL COPY FROM as TSV
+
+        COPY beats even multi-row INSERTs, but cannot skip conflicting rows,
+        so duplicates are filtered while writing the buffers.
+        """
+
+        buf = io.StringIO()
+        seen_about = set()
+        for tk, _ in tk_buffer:
+            if tk.about in seen_about:
+                continue
+            seen_about.add(tk.about)
+            buf.write(
+                f"{thesaurus.id}\t{escape_copy(tk.about)}\t{escape_copy(tk.alt_label)}\n"
+            )
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_from(
+                buf,
+                ThesaurusKeyword._meta.db_table,
+                columns=("thesaurus_id", "about", "alt_label"),
+            )
+
+        keyword_ids = self._keyword_ids(thesaurus, tk_buffer)
+        buf = io.StringIO()
+        seen_lang = set()
+        for tk, label_rows in tk_buffer:
+            keyword_id = keyword_ids[tk.about]
+            for lang, label in label_rows:
+                # one label per language and keyword, like the unique
+                # constraint the bulk_create path leaves to the DB
+                if (keyword_id, lang) in seen_lang:
+                    continue
+                seen_lang.add((keyword_id, lang))
+                buf.write(
+                    f"{keyword_id}\t{escape_copy(lang)}\t{escape_copy(label)}\n"
+                )
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_from(
+                buf,
+                ThesaurusKeywordLabel._meta.db_table,
+                columns=("keyword_id", "lang", "label"),
+            )
+
+    def _flush_with_bulk_create(self, thesaurus, tk_buffer):
+        # duplicates are dropped by the DB (ON CONFLICT DO NOTHING); the
+        # keyword_ids query below resolves to the already-existing rows
+        ThesaurusKeyword.objects.bulk_create(
+            [tk for tk, _ in tk_buffer],
+            batch_size=BULK_CREATE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        keyword_ids = self._keyword_ids(thesaurus, tk_buffer)
+        tkl_buffer = [
+            ThesaurusKeywordLabel(
+                keyword_id=keyword_ids[tk.about], lang=lang, label=label
+            )
+            for tk, label_rows in tk_buffer
+            for lang, label in label_rows
+        ]
+        # duplicates are dropped by the DB instead of a try/except per row
+        ThesaurusKeywordLabel.objects.bulk_create(
+            tkl_buffer,
+            batch_size=BULK_CREATE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+
+def supports_copy_from() -> bool:
+    """True when the DB cursor exposes psycopg2's copy_from (PostgreSQL only)"""
+
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        return hasattr(cursor, "copy_from")
+
+
+def escape_copy(value: str) -> str:
+    """escape a value for the PostgreSQL COPY text format"""
+
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
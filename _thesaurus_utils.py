@@ -0,0 +1,73 @@
+#########################################################################
+#
+# Copyright (C) 2022 Leibniz-Centre for Agricultural Landscape
+# Research (ZALF) e.V.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""helpers shared by the AGROVOC and GEMET thesaurus loader commands
+
+Copy this module next to the load_*_thesaurus.py commands into
+geonode/base/management/commands/.
+"""
+
+from datetime import datetime
+from typing import List
+
+from rdflib import Literal
+
+
+def isoformat_naive(value: str) -> str:
+    """convert a xsd:dateTime string to a naive isoformat date for the DB model"""
+
+    if not value:
+        return ""
+    return (
+        datetime.fromisoformat(value.replace("Z", "+00:00"))
+        .replace(tzinfo=None)
+        .isoformat()
+    )
+
+
+def lower_if_needed(value: str) -> str:
+    """lower-case a value, skipping the copy when it already is lower case"""
+
+    return value if value.islower() else value.lower()
+
+
+def value_for_language(available: List[Literal], default_lang: str) -> str:
+    """pick a title literal: no language tag wins, then the default language,
+    then the first one available"""
+
+    none_lang = None
+    match = None
+    # prefix test instead of lang.split("-")[0], which allocates a list per
+    # candidate; "en-US" still matches a default_lang of "en"
+    default_lang_prefix = default_lang + "-"
+    for literal in available:
+        lang = literal.language
+        if lang is None:
+            if none_lang is None:
+                none_lang = literal
+        elif match is None and (
+            lang == default_lang or lang.startswith(default_lang_prefix)
+        ):
+            match = literal
+    if none_lang is not None:
+        return str(none_lang)
+    if match is not None:
+        return str(match)
+    return str(available[0])
@@ -18,23 +18,20 @@
 #
 #########################################################################
 
-from typing import List
+from collections import defaultdict
+from sys import intern
 
-from django.conf import settings
-from django.core.files.uploadedfile import UploadedFile
-from django.core.management.base import BaseCommand, CommandError
+from django.core.management.base import CommandError
 from rdflib import Graph, Literal, URIRef
-from rdflib.namespace import RDF, RDFS, SKOS, DC, DCTERMS
+from rdflib.namespace import RDF, SKOS, DC, DCTERMS
 
-from rdflib.util import guess_format
-
-from geonode.base.models import Thesaurus, ThesaurusKeyword, ThesaurusKeywordLabel
-
-
-def __apply_lower_case__(value: str, lower_case: bool):
-    if lower_case:
-        return value.lower()
-    return value
+from ._thesaurus_loader import (
+    ParsedThesaurus,
+    ThesaurusLoader,
+    parse_triples,
+    pyoxigraph,
+)
+from ._thesaurus_utils import isoformat_naive
 
 
 class SKOS_XL:
@@ -47,222 +44,123 @@ class SKOS_XL:
 # only including concepts for the AGROVOC core concept scheme
 AGROVOC_ConceptSchemeURI = URIRef("http://aims.fao.org/aos/agrovoc")
 
-# To reduce storage this script only includes languages supported by geonode and not all languages included in the AGROVOC,
-SUPPORTED_LANGUAGES = ["fr", "de", "en", "it", "es"]
-DEFAULT_LANG = getattr(settings, "THESAURUS_DEFAULT_LANG", "en")
-
 
-class Command(BaseCommand):
+class Command(ThesaurusLoader):
     help = "(Down)Load a AGROVOC in RDF format into DB"
 
-    def add_arguments(self, parser):
-        # Named (optional) arguments
-        parser.add_argument(
-            "-d",
-            "--dry-run",
-            action="store_true",
-            dest="dryrun",
-            default=False,
-            help="Only parse and print the thesaurus file, without perform insertion in the DB.",
-        )
-
-        parser.add_argument(
-            "--name",
-            dest="name",
-            help="Identifier name for the thesaurus in this GeoNode instance.",
-        )
-
-        parser.add_argument(
-            "--file", dest="file", help="Full path to a thesaurus in RDF format."
-        )
-
-        parser.add_argument(
-            "--title",
-            dest="title",
-            default="AGROVOC",
-            help="title to set in the base_thesaurus table for the agrovoc thesaurus",
-        )
-
-        parser.add_argument(
-            "--description",
-            dest="description",
-            default="""
-            AGROVOC is a multilingual and controlled vocabulary designed to cover concepts and terminology under FAO's areas of interest. 
-            """,
-            help="description to set in the base_thesaurus table for the agrovoc thesaurus",
-        )
-
-        parser.add_argument(
-            "--force-lower-case",
-            dest="lower_case",
-            action="store_true",
-            help="all tkeywords and and tkeywordlabels are stored in lower case ...",
-        )
+    def thesaurus_date(self, parsed: ParsedThesaurus) -> str:
+        # make date confirm to geonode thesaurus database model
+        return isoformat_naive(parsed.date)
+
+    def stream_parse(self, input_file, mime_type: str) -> ParsedThesaurus:
+        """single streaming pass over the RDF file using pyoxigraph
+
+        Projects the triples directly into plain dicts/lists keyed by IRI
+        strings, without materializing a triple store.
+        """
+
+        xl_pref_label = str(SKOS_XL.prefLabel)
+        xl_literal_form = str(SKOS_XL.literalForm)
+        rdf_type = str(RDF.type)
+        concept_scheme = str(SKOS.ConceptScheme)
+        in_scheme = str(SKOS.inScheme)
+        scheme_uri = str(AGROVOC_ConceptSchemeURI)
+        dc_description = str(DC.description)
+        dcterms_modified = str(DCTERMS.modified)
+
+        scheme_found = False
+        titles = []
+        scheme_values = {}
+        concepts = []
+        pref_links = defaultdict(list)  # concept IRI -> [SKOS-XL label node ids]
+        literal_forms = {}  # SKOS-XL label node id -> (lang, label)
+
+        # concept and label-node IRIs occur in several triples each and language
+        # tags only take a handful of distinct values; interning collapses the
+        # duplicates to one string object apiece
+        for s, p, o in parse_triples(input_file, mime_type):
+            predicate = p.value
+            if predicate == xl_literal_form:
+                lang = o.language
+                literal_forms[intern(s.value)] = (
+                    intern(lang) if lang is not None else None,
+                    o.value,
+                )
+            elif predicate == xl_pref_label:
+                pref_links[intern(s.value)].append(intern(o.value))
+            elif predicate == in_scheme and o.value == scheme_uri:
+                concepts.append(intern(s.value))
+            elif s.value == scheme_uri:
+                if predicate == rdf_type and o.value == concept_scheme:
+                    scheme_found = True
+                elif isinstance(o, pyoxigraph.Literal):
+                    titles.append(Literal(o.value, lang=o.language))
+                    scheme_values[predicate] = o.value
+
+        if not scheme_found:
+            raise CommandError("ConceptScheme not found in file")
 
-        parser.add_argument(
-            "--defaultlang",
-            dest="default_lang",
-            type=str,
-            default=DEFAULT_LANG,
-            help="change default language.",
+        labels_by_concept = {
+            concept: [literal_forms[n] for n in nodes if n in literal_forms]
+            for concept, nodes in pref_links.items()
+        }
+
+        return ParsedThesaurus(
+            scheme=scheme_uri,
+            date=scheme_values.get(dcterms_modified, ""),
+            titles=titles,
+            description=scheme_values.get(dc_description),
+            concepts=concepts,
+            labels_by_concept=labels_by_concept,
         )
 
-    def handle(self, **options):
-        input_file = options.get("file")
-        name = options.get("name")
-        title = options.get("title")
-        description = options.get("description")
-        dryrun = options.get("dryrun")
-        defaultlang = options.get("default_lang")
-        lower_case = options.get("lower_case")
-
-        if not input_file:
-            raise CommandError("Missing thesaurus rdf file path (--file)")
+    def graph_parse(self, input_file, rdf_format: str) -> ParsedThesaurus:
+        """parse via rdflib and project the graph into the same plain structures"""
 
-        if not name:
-            raise CommandError("Missing identifier name for the thesaurus (--name)")
-
-        self.load_thesaurus(
-            input_file=input_file,
-            name=name,
-            store=not dryrun,
-            title=title,
-            description=description,
-            defaultlang=defaultlang,
-            lower_case=lower_case,
-        )
-
-    def load_thesaurus(
-        self,
-        input_file: str,
-        name: str,
-        store: bool,
-        title: str,
-        description: str,
-        defaultlang: str,
-        lower_case: bool,
-    ):
         g = Graph()
-
-        # if the input_file is an UploadedFile object rather than a file path the Graph.parse()
-        # method may not have enough info to correctly guess the type; in this case supply the
-        # name, which should include the extension, to guess_format manually...
-        rdf_format = None
-        if isinstance(input_file, UploadedFile):
-            self.stderr.write(
-                self.style.WARNING(f"Guessing RDF format from {input_file.name}...")
-            )
-            rdf_format = guess_format(input_file.name)
-
-        self.stderr.write(
-            self.style.SUCCESS(f"Starting to parsed file: {input_file} ...")
-        )
         g.parse(input_file, format=rdf_format)
-        self.stderr.write(
-            self.style.SUCCESS(f"Successful parsed file: {input_file} ...")
-        )
-
-        # make date confirm to geonode thesaurus database model
-        thesaurus_date = Literal(
-            g.value(AGROVOC_ConceptSchemeURI, DCTERMS.modified, None, default="")
-        ).toPython()
-        thesaurus_date = thesaurus_date.replace(tzinfo=None).isoformat()
 
         scheme = g.value(None, RDF.type, SKOS.ConceptScheme, any=False)
-
         if scheme is None:
             raise CommandError("ConceptScheme not found in file")
 
-        available_titles = [t for t in g.objects(scheme) if isinstance(t, Literal)]
-        thesaurus_title = value_for_language(available_titles, defaultlang)
-        description = g.value(scheme, DC.description, None, default=thesaurus_title)
-
-        # define Thesaurus metadata for AGROVOC
-        thesaurus = Thesaurus()
-        thesaurus.identifier = name
-        thesaurus.description = description
-        thesaurus.title = thesaurus_title
-        thesaurus.about = str(scheme)
-        thesaurus.date = thesaurus_date
-
-        if store:
-            thesaurus.save()
-
-        self.stderr.write(
-            self.style.SUCCESS(
-                f'Thesaurus "{title}", desc: {description} issued at {thesaurus_date}'
-            )
-        )
-
-        # skipping thesaurus label due to no thesaurus metadata in agrovoc found
-        for concept in g.subjects(SKOS.inScheme, AGROVOC_ConceptSchemeURI):
-            about = __apply_lower_case__(str(concept), lower_case)
-            alt_label = get_default_language_preflabel(g, concept, defaultlang)
-            if alt_label is None:
-                continue
-            alt_label = __apply_lower_case__(str(alt_label), lower_case)
-            if alt_label is None:
-                self.stderr.write(
-                    self.style.ERROR(
-                        f"could not find preflabel for concept ({concept}) in THESAURUS_DEFAULT_LANG({defaultlang}), skipping entry ..."
-                    )
-                )
+        # one traversal of the scheme's triples replaces the separate
+        # objects/value queries for titles, description and date
+        scheme_props = defaultdict(list)
+        for _, predicate, obj in g.triples((scheme, None, None)):
+            if isinstance(obj, Literal):
+                scheme_props[predicate].append(obj)
+
+        titles = [lit for values in scheme_props.values() for lit in values]
+        description = next(iter(scheme_props.get(DC.description, ())), None)
+        modified = str(next(iter(scheme_props.get(DCTERMS.modified, ())), ""))
+
+        # index all SKOS-XL pref labels in two single passes over the graph; the
+        # concept loop then works on small per-concept lists instead of querying
+        # the triple store per concept, and the literalForm of each label node
+        # comes from one dict built in one traversal instead of a g.value index
+        # lookup per label
+        literal_form_of = dict(g.subject_objects(SKOS_XL.literalForm))
+        labels_by_concept = defaultdict(list)
+        for concept, pref_label_element in g.subject_objects(SKOS_XL.prefLabel):
+            pref_label = literal_form_of.get(pref_label_element)
+            if pref_label is None:
                 continue
+            lang = pref_label.language
+            labels_by_concept[intern(str(concept))].append(
+                (intern(lang) if lang is not None else None, str(pref_label))
+            )
 
-            tk = ThesaurusKeyword()
-            tk.thesaurus = thesaurus
-            tk.about = about
-            tk.alt_label = alt_label
-            if store:
-                tk.save()
-
-            i = 0
-            for pref_label_element in g.objects(concept, SKOS_XL.prefLabel):
-                pref_label = Literal(
-                    g.value(pref_label_element, SKOS_XL.literalForm, None)
-                )
-                lang = __apply_lower_case__(pref_label.language, lower_case)
-                if lang not in SUPPORTED_LANGUAGES:
-                    continue
-
-                label = __apply_lower_case__(str(pref_label), lower_case)
-                tkl = ThesaurusKeywordLabel()
-                tkl.keyword = tk
-                tkl.lang = lang
-                tkl.label = label
-                i += 1
-                if store:
-                    try:
-                        tkl.save()
-                    except:
-                        self.stderr.write(
-                            self.style.ERROR(
-                                f"could not add label: {label} with language: {lang}) to database, skipping entry ..."
-                            )
-                        )
-
-            self.stderr.write(self.style.SUCCESS(f" set alt_label: {alt_label}: ({i})"))
-
-
-def value_for_language(available: List[Literal], default_lang: str) -> str:
-    sorted_lang = sorted(
-        available,
-        key=lambda literal: "" if literal.language is None else literal.language,
-    )
-    for item in sorted_lang:
-        if item.language is None:
-            return str(item)
-        elif item.language.split("-")[0] == default_lang:
-            return str(item)
-    return str(available[0])
-
-
-def get_default_language_preflabel(g: Graph, concept: URIRef, default_lang: str) -> str:
-    """searching for preflabel with default lang"""
-
-    for label in g.objects(concept, SKOS_XL.prefLabel):
-        pref_label = Literal(g.value(label, SKOS_XL.literalForm, None))
-        language = pref_label.language
-        if language == default_lang:
-            return str(pref_label)
-    return None
+        # interned to share the string objects with the labels_by_concept keys
+        concepts = [
+            intern(str(c)) for c in g.subjects(SKOS.inScheme, AGROVOC_ConceptSchemeURI)
+        ]
+
+        return ParsedThesaurus(
+            scheme=str(scheme),
+            date=modified,
+            titles=titles,
+            description=str(description) if description is not None else None,
+            concepts=concepts,
+            labels_by_concept=labels_by_concept,
+        )
@@ -18,227 +18,160 @@
 #
 #########################################################################
 
-from typing import List
+from collections import defaultdict
+from sys import intern
 
-from django.conf import settings
-from django.core.files.uploadedfile import UploadedFile
-from django.core.management.base import BaseCommand, CommandError
+from django.core.management.base import CommandError
 from rdflib import Graph, Literal
 from rdflib.namespace import RDF, RDFS, SKOS, DC, DCTERMS
-from rdflib.util import guess_format
 
-from geonode.base.models import (
-    Thesaurus,
-    ThesaurusKeyword,
-    ThesaurusKeywordLabel,
+from ._thesaurus_loader import (
+    ParsedThesaurus,
+    ThesaurusLoader,
+    parse_triples,
+    pyoxigraph,
 )
 
-SUPPORTED_LANGUAGES = ["fr", "de", "en", "it", "es"]
-DEFAULT_LANG = getattr(settings, "THESAURUS_DEFAULT_LANG", "en")
 
-
-def __apply_lower_case__(value: str, lower_case: bool):
-    if lower_case:
-        return value.lower()
-    return value
-
-
-class Command(BaseCommand):
+class Command(ThesaurusLoader):
     help = "Load a thesaurus in RDF format into DB"
 
-    def add_arguments(self, parser):
-        # Named (optional) arguments
-        parser.add_argument(
-            "-d",
-            "--dry-run",
-            action="store_true",
-            dest="dryrun",
-            default=False,
-            help="Only parse and print the thesaurus file, without perform insertion in the DB.",
-        )
-
-        parser.add_argument(
-            "--name",
-            dest="name",
-            help="Identifier name for the thesaurus in this GeoNode instance.",
-        )
-
-        parser.add_argument(
-            "--defaultlang",
-            dest="default_lang",
-            type=str,
-            default=DEFAULT_LANG,
-            help="change default language.",
-        )
-
-        parser.add_argument(
-            "--force-lower-case",
-            dest="lower_case",
-            action="store_true",
-            help="all tkeywords and and tkeywordlabels are stored in lower case ...",
+    def thesaurus_date(self, parsed: ParsedThesaurus) -> str:
+        return parsed.date or "2024-01-01"
+
+    def stream_parse(self, input_file, mime_type: str) -> ParsedThesaurus:
+        """single streaming pass over the RDF file using pyoxigraph
+
+        Projects the triples directly into plain dicts/lists keyed by IRI
+        strings, without materializing a triple store.
+        """
+
+        rdf_type = str(RDF.type)
+        concept_scheme = str(SKOS.ConceptScheme)
+        concept_type = str(SKOS.Concept)
+        pref_label = str(SKOS.prefLabel)
+        rdfs_label = str(RDFS.label)
+        # scheme-level metadata predicates; the rdflib path considers every
+        # literal attached to the scheme, these cover the ones GEMET ships
+        scheme_predicates = frozenset(
+            str(p) for p in (DC.title, DCTERMS.title, DC.description, DCTERMS.issued)
         )
 
-        parser.add_argument(
-            "--file", dest="file", help="Full path to a thesaurus in RDF format."
+        schemes = []
+        concepts = []
+        label_index = {pref_label: defaultdict(list), rdfs_label: defaultdict(list)}
+        scheme_values = defaultdict(dict)  # subject IRI -> {predicate: literal}
+
+        # concept IRIs occur in several triples each and language tags only take
+        # a handful of distinct values; interning collapses the duplicates to
+        # one string object apiece
+        for s, p, o in parse_triples(input_file, mime_type):
+            predicate = p.value
+            if predicate in label_index:
+                if isinstance(o, pyoxigraph.Literal):
+                    lang = o.language
+                    label_index[predicate][intern(s.value)].append(
+                        (intern(lang) if lang is not None else None, o.value)
+                    )
+            elif predicate == rdf_type:
+                if o.value == concept_type:
+                    concepts.append(intern(s.value))
+                elif o.value == concept_scheme:
+                    schemes.append(s.value)
+            elif predicate in scheme_predicates and isinstance(o, pyoxigraph.Literal):
+                scheme_values[s.value][predicate] = Literal(o.value, lang=o.language)
+
+        if not schemes:
+            raise CommandError("ConceptScheme not found in file")
+        if len(schemes) > 1:
+            raise CommandError("More than one ConceptScheme found in file")
+        scheme = schemes[0]
+
+        titles = [
+            Literal(label, lang=lang)
+            for prop in (pref_label, rdfs_label)
+            for lang, label in label_index[prop].get(scheme, ())
+        ]
+        titles.extend(scheme_values[scheme].values())
+        description = scheme_values[scheme].get(str(DC.description))
+        issued = scheme_values[scheme].get(str(DCTERMS.issued))
+
+        return ParsedThesaurus(
+            scheme=scheme,
+            date=str(issued) if issued is not None else None,
+            titles=titles,
+            description=str(description) if description is not None else None,
+            concepts=concepts,
+            labels_by_concept=flatten_label_index(
+                concepts, label_index[pref_label], label_index[rdfs_label]
+            ),
         )
 
-    def handle(self, **options):
-        input_file = options.get("file")
-        name = options.get("name")
-        dryrun = options.get("dryrun")
-        defaultlang = options.get("default_lang")
-        lower_case = options.get("lower_case")
-
-        if not input_file:
-            raise CommandError("Missing thesaurus rdf file path (--file)")
-
-        if not name:
-            raise CommandError("Missing identifier name for the thesaurus (--name)")
+    def graph_parse(self, input_file, rdf_format: str) -> ParsedThesaurus:
+        """parse via rdflib and project the graph into the same plain structures"""
 
-        self.load_thesaurus(input_file, name, defaultlang, not dryrun, lower_case)
-
-    def load_thesaurus(self, input_file, name, defaultlang, store, lower_case):
         g = Graph()
-        self.stderr.write(self.style.SUCCESS(f" using defaultlang: {defaultlang} ..."))
-        # if the input_file is an UploadedFile object rather than a file path the Graph.parse()
-        # method may not have enough info to correctly guess the type; in this case supply the
-        # name, which should include the extension, to guess_format manually...
-        rdf_format = None
-        if isinstance(input_file, UploadedFile):
-            self.stderr.write(
-                self.style.WARNING(f"Guessing RDF format from {input_file.name}...")
-            )
-            rdf_format = guess_format(input_file.name)
         g.parse(input_file, format=rdf_format)
 
         # An error will be thrown here there is more than one scheme in the file
         scheme = g.value(None, RDF.type, SKOS.ConceptScheme, any=False)
-
         if scheme is None:
             raise CommandError("ConceptScheme not found in file")
 
-        available_titles = [t for t in g.objects(scheme) if isinstance(t, Literal)]
-        thesaurus_title = value_for_language(available_titles, defaultlang)
-        description = g.value(scheme, DC.description, None, default=thesaurus_title)
-        date_issued = g.value(scheme, DCTERMS.issued, None, default="2024-01-01")
-
-        self.stderr.write(
-            self.style.SUCCESS(
-                f'Thesaurus "{thesaurus_title}", desc: {description} issued at {date_issued}'
-            )
+        # one traversal of the scheme's triples replaces the separate
+        # objects/value queries for titles, description and date
+        scheme_props = defaultdict(list)
+        for _, predicate, obj in g.triples((scheme, None, None)):
+            if isinstance(obj, Literal):
+                scheme_props[predicate].append(obj)
+
+        titles = [lit for values in scheme_props.values() for lit in values]
+        description = next(iter(scheme_props.get(DC.description, ())), None)
+        issued = next(iter(scheme_props.get(DCTERMS.issued, ())), None)
+
+        # index all labels in a single pass over the graph instead of
+        # querying the triple store twice per concept
+        label_index = {SKOS.prefLabel: defaultdict(list), RDFS.label: defaultdict(list)}
+        for prop, by_subject in label_index.items():
+            for subject, label in g.subject_objects(prop):
+                if isinstance(label, Literal):
+                    lang = label.language
+                    by_subject[intern(str(subject))].append(
+                        (intern(lang) if lang is not None else None, str(label))
+                    )
+
+        # interned to share the string objects with the label_index keys
+        concepts = [intern(str(c)) for c in g.subjects(RDF.type, SKOS.Concept)]
+
+        return ParsedThesaurus(
+            scheme=str(scheme),
+            date=str(issued) if issued is not None else None,
+            titles=titles,
+            description=str(description) if description is not None else None,
+            concepts=concepts,
+            labels_by_concept=flatten_label_index(
+                concepts, label_index[SKOS.prefLabel], label_index[RDFS.label]
+            ),
         )
 
-        # Define Thesaurus Data
-        thesaurus = Thesaurus()
-        thesaurus.identifier = name
-        thesaurus.description = description
-        thesaurus.title = thesaurus_title
-        thesaurus.about = str(scheme)
-        thesaurus.date = date_issued
-
-        if store:
-            thesaurus.save()
-
-        for concept in g.subjects(RDF.type, SKOS.Concept):
-            try:
-                pref = __apply_lower_case__(
-                    preferredLabel(g, concept, defaultlang)[0][1], lower_case
-                )
-            except:
-                self.style.ERROR(
-                    f"could not find {str(concept) } in default language {defaultlang} ..."
-                )
-                continue
-            about = __apply_lower_case__(str(concept), lower_case)
-
-            self.stderr.write(self.style.SUCCESS(f"Concept: {str(pref)} ({about})"))
-
-            # Store Keyword
-            tk = ThesaurusKeyword()
-            tk.thesaurus = thesaurus
-            tk.about = about
-            tk.alt_label = pref
-            try:
-                if store:
-                    tk.save()
-
-                for _, pref_label in preferredLabel(g, concept):
-                    lang = __apply_lower_case__(pref_label.language, lower_case)
-                    label = __apply_lower_case__(str(pref_label), lower_case)
-                    if lang in SUPPORTED_LANGUAGES:
-                        self.stderr.write(
-                            self.style.SUCCESS(f"  Label {lang}: {label}")
-                        )
-
-                        tkl = ThesaurusKeywordLabel()
-                        tkl.keyword = tk
-                        tkl.lang = lang
-                        tkl.label = label
-
-                        if store:
-                            tkl.save()
-            except:
-                print(f"could not save: {str(pref)}, duplicate ...")
-
-
-def value_for_language(available: List[Literal], default_lang: str) -> str:
-    sorted_lang = sorted(
-        available,
-        key=lambda literal: "" if literal.language is None else literal.language,
-    )
-    for item in sorted_lang:
-        if item.language is None:
-            return str(item)
-        elif item.language.split("-")[0] == default_lang:
-            return str(item)
-    return str(available[0])
-
-
-def preferredLabel(
-    g,
-    subject,
-    lang=None,
-    default=None,
-    label_properties=(SKOS.prefLabel, RDFS.label),
-):
-    """
-    Find the preferred label for subject.
-
-    By default prefers skos:prefLabels over rdfs:labels. In case at least
-    one prefLabel is found returns those, else returns labels. In case a
-    language string (e.g., "en", "de" or even "" for no lang-tagged
-    literals) is given, only such labels will be considered.
 
-    Return a list of (labelProp, label) pairs, where labelProp is either
-    skos:prefLabel or rdfs:label.
+def flatten_label_index(concepts, pref_by_subject, rdfs_by_subject):
+    """collapse the per-property label index into flat per-concept lists
 
-    Copied from rdflib 6.1.1
+    The property preference is applied per language, like rdflib's
+    preferredLabel did: for each language the skos:prefLabels win and the
+    rdfs:labels only fill in languages without one.
     """
 
-    if default is None:
-        default = []
-
-    # setup the language filtering
-    if lang is not None:
-        if lang == "":  # we only want not language-tagged literals
-
-            def langfilter(l_):
-                return l_.language is None
-
-        else:
-
-            def langfilter(l_):
-                return l_.language == lang
-
-    else:  # we don't care about language tags
-
-        def langfilter(l_):
-            return True
-
-    for labelProp in label_properties:
-        labels = list(filter(langfilter, g.objects(subject, labelProp)))
-        if len(labels) == 0:
+    flat = {}
+    for concept in concepts:
+        pref = pref_by_subject.get(concept, ())
+        rdfs = rdfs_by_subject.get(concept, ())
+        if not rdfs:
+            flat[concept] = pref
             continue
-        else:
-            return [(labelProp, l_) for l_ in labels]
-    return default
+        pref_langs = {lang for lang, _ in pref}
+        labels = list(pref)
+        labels.extend(row for row in rdfs if row[0] not in pref_langs)
+        flat[concept] = labels
+    return flat